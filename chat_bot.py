@@ -1,24 +1,57 @@
 import sys
-import json
 import requests
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel,
-    QTextEdit, QPushButton, QComboBox, QScrollArea, QFrame,
-    QListWidget, QListWidgetItem, QFileDialog
+    QTextEdit, QPushButton, QComboBox, QFrame,
+    QListWidget, QListWidgetItem, QFileDialog,
+    QListView, QStyledItemDelegate, QAbstractItemView
 )
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QTimer, QEasingCurve, QPropertyAnimation, QPoint
-from PyQt6.QtGui import QClipboard
+from PyQt6.QtCore import (
+    Qt, QThread, pyqtSignal, QTimer, QUrl, QThreadPool, QVariantAnimation, QEasingCurve,
+    QAbstractListModel, QModelIndex, QPersistentModelIndex, QRect, QRectF, QSize, QEvent
+)
+from PyQt6.QtGui import QClipboard, QTextCursor, QTextDocument, QPainter, QCursor
+from collections import OrderedDict
+from functools import lru_cache
 import speech_recognition as sr
 import pyttsx3
-import uuid
 import re
 import os
+import html
+import hashlib
+import sqlite3
+import threading
+import io
+import queue
+import secrets
 
 try:
     from PyPDF2 import PdfReader
 except Exception:
     PdfReader = None
 
+# Optional audio playback for cached TTS
+try:
+    from PyQt6.QtMultimedia import QSoundEffect
+except Exception:
+    QSoundEffect = None
+
+# Optional offline speech recognition
+try:
+    from faster_whisper import WhisperModel
+except Exception:
+    WhisperModel = None
+
+# Optional fast JSON; both parsers accept bytes and _jdumps always returns bytes
+try:
+    from orjson import loads as _jloads, dumps as _jdumps
+except Exception:
+    import json
+    from json import loads as _jloads
+
+    def _jdumps(obj):
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
 # Optional docx reader
 try:
     import docx
@@ -26,11 +59,40 @@ except Exception:
     docx = None
 
 OLLAMA_API_URL = "http://localhost:11434"
+MAX_CTX_MSGS = 20  # rolling window of history sent with each request
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ai_assistant")
+TTS_CACHE_DIR = os.path.join(CACHE_DIR, "tts")
+CHAT_DB_PATH = os.path.join(CACHE_DIR, "chats.db")
+WHISPER_MODEL = "base.en"
+LOW_POWER = bool(os.environ.get("AI_ASSISTANT_LOW_POWER"))  # disables animations
+
+_TAG_RE = re.compile(r"<[^>]*>")
+
+_asr_model = None
+_asr_lock = threading.Lock()
+
+
+def _get_asr():
+    # Loading the model is slow, so it is shared by every VoiceThread
+    global _asr_model
+    with _asr_lock:
+        if _asr_model is None:
+            _asr_model = WhisperModel(WHISPER_MODEL, device="cpu", compute_type="int8")
+        return _asr_model
+
+# One keep-alive connection pool for every call to Ollama
+SESSION = requests.Session()
+SESSION.headers.update({"Accept-Encoding": "identity"})
+
+
+@lru_cache(maxsize=4096)
+def _format_html(t):
+    # Messages never change once stored, so replayed history hits the cache
+    return html.escape(t, quote=False).replace("\n", "<br>")
 
 
 # --- Worker: stream from /api/chat and emit chunks (message.content) ---
 class OllamaWorker(QThread):
-    response_chunk = pyqtSignal(str)
     full_response = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
     typing_signal = pyqtSignal(bool)
@@ -40,38 +102,60 @@ class OllamaWorker(QThread):
         self.model = model
         self.messages = messages
         self._running = True
+        # Chunks are polled by the GUI instead of signalled one by one
+        self.chunks = queue.SimpleQueue()
 
     def stop(self):
         self._running = False
 
+    @staticmethod
+    def _iter_ndjson(r, chunk_size=65536):
+        # Split NDJSON ourselves from large reads; iter_lines() works in 512-byte steps
+        tail = bytearray()
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            if not chunk:
+                continue
+            tail += chunk
+            *lines, rest = tail.split(b"\n")
+            tail = bytearray(rest)
+            for line in lines:
+                if line.strip():
+                    yield line
+        if tail.strip():
+            yield bytes(tail)
+
     def run(self):
         self.typing_signal.emit(True)
         try:
-            payload = {"model": self.model, "messages": self.messages, "stream": True}
-            full = ""
-            with requests.post(f"{OLLAMA_API_URL}/api/chat", json=payload, stream=True, timeout=120) as r:
+            body = _jdumps({"model": self.model, "messages": self.messages, "stream": True})
+            full = []
+            with SESSION.post(
+                f"{OLLAMA_API_URL}/api/chat",
+                data=body,
+                headers={"Content-Type": "application/json"},
+                stream=True,
+                timeout=120,
+            ) as r:
                 r.raise_for_status()
-                for line in r.iter_lines():
+                for line in self._iter_ndjson(r):
                     if not self._running:
                         break
-                    if not line:
-                        continue
                     try:
-                        data = json.loads(line.decode("utf-8"))
+                        data = _jloads(line)
                     except Exception:
                         continue
-  
+
                     # Newer Ollama chat streaming format
                     if isinstance(data, dict) and "message" in data and isinstance(data["message"], dict):
                         content = data["message"].get("content")
                         if content:
-                            full += content
-                            self.response_chunk.emit(content)
+                            full.append(content)
+                            self.chunks.put_nowait(content)
 
                     if isinstance(data, dict) and data.get("done", False):
                         break
 
-            self.full_response.emit(full)
+            self.full_response.emit("".join(full))
         except Exception as e:
             self.error_occurred.emit(str(e))
         finally:
@@ -82,10 +166,18 @@ class VoiceThread(QThread):
     text_recognized = pyqtSignal(str)
     listening_status = pyqtSignal(bool)
 
-    def __init__(self, recognizer):
+    def __init__(self, recognizer, pool):
         super().__init__()
         self.recognizer = recognizer
         self._active = True
+        self._stop_bg = None
+        self.asr = None
+        # Phrases are recognized in parallel but emitted in the order spoken
+        self._pool = pool
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._next_emit = 0
+        self._results = {}
 
     def stop_listening(self):
         self._active = False
@@ -93,26 +185,62 @@ class VoiceThread(QThread):
     def run(self):
         self.listening_status.emit(True)
         try:
-            with sr.Microphone() as src:
+            if WhisperModel is not None:
+                try:
+                    self.asr = _get_asr()
+                except Exception:
+                    self.asr = None
+            mic = sr.Microphone()
+            with mic as src:
                 self.recognizer.adjust_for_ambient_noise(src)
-                while self._active:
-                    try:
-                        audio = self.recognizer.listen(src, timeout=3, phrase_time_limit=6)
-                        text = self.recognizer.recognize_google(audio)
-                        self.text_recognized.emit(text)
-                    except Exception:
-                        continue
+            # Capture keeps running while earlier phrases are being recognized
+            self._stop_bg = self.recognizer.listen_in_background(mic, self._on_audio, phrase_time_limit=6)
+            while self._active:
+                self.msleep(100)
+        except Exception:
+            pass
         finally:
+            if self._stop_bg:
+                self._stop_bg(wait_for_stop=False)
+                self._stop_bg = None
             self.listening_status.emit(False)
 
+    def _on_audio(self, recognizer, audio):
+        if not self._active:
+            return
+        with self._lock:
+            seq = self._seq
+            self._seq += 1
+        self._pool.start(lambda: self._recognize(seq, audio))
+
+    def _recognize(self, seq, audio):
+        try:
+            if self.asr is not None:
+                segments, _ = self.asr.transcribe(io.BytesIO(audio.get_wav_data()))
+                text = "".join(seg.text for seg in segments).strip()
+            else:
+                text = self.recognizer.recognize_google(audio)
+        except Exception:
+            text = None
+        with self._lock:
+            self._results[seq] = text
+            ready = []
+            while self._next_emit in self._results:
+                ready.append(self._results.pop(self._next_emit))
+                self._next_emit += 1
+        for text in ready:
+            if text and self._active:
+                self.text_recognized.emit(text)
+
 
 class TTSThread(QThread):
     finished_speaking = pyqtSignal()
 
-    def __init__(self, engine, text):
+    def __init__(self, engine, text, path=None):
         super().__init__()
         self.engine = engine
         self.text = text
+        self.path = path  # synthesize to this WAV instead of speaking
         self._stopped = False
 
     def stop(self):
@@ -124,12 +252,231 @@ class TTSThread(QThread):
 
     def run(self):
         try:
-            self.engine.say(self.text)
-            self.engine.runAndWait()
+            if self.path:
+                tmp = self.path + ".part.wav"
+                self.engine.save_to_file(self.text, tmp)
+                self.engine.runAndWait()
+                if not os.path.exists(tmp):
+                    return
+                if self._stopped:
+                    os.remove(tmp)
+                    return
+                os.replace(tmp, self.path)
+            else:
+                self.engine.say(self.text)
+                self.engine.runAndWait()
         finally:
             self.finished_speaking.emit()
 
 
+class FileParseThread(QThread):
+    page_ready = pyqtSignal(str)
+    finished_parsing = pyqtSignal()
+    error_occurred = pyqtSignal(str)
+
+    def __init__(self, path, ext):
+        super().__init__()
+        self.path = path
+        self.ext = ext
+
+    def run(self):
+        try:
+            if self.ext == ".txt":
+                with open(self.path, "r", encoding="utf-8") as fh:
+                    self.page_ready.emit(fh.read())
+            elif self.ext == ".docx":
+                d = docx.Document(self.path)
+                self.page_ready.emit("\n".join(p.text for p in d.paragraphs))
+            elif self.ext == ".pdf":
+                reader = PdfReader(self.path)
+                for p in reader.pages:
+                    try:
+                        self.page_ready.emit((p.extract_text() or "") + "\n")
+                    except Exception:
+                        continue
+        except Exception as e:
+            self.error_occurred.emit(str(e))
+        finally:
+            self.finished_parsing.emit()
+
+
+# --- Chat view: rows live in a model and are painted by a delegate ---
+class ChatModel(QAbstractListModel):
+    DocRole = Qt.ItemDataRole.UserRole + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._roles = []
+        self._texts = []
+        self._stream_doc = None  # live document of the row being streamed
+        self._stream_row = QPersistentModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._texts)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self._texts[row]
+        if role == Qt.ItemDataRole.UserRole:
+            return self._roles[row]
+        if role == self.DocRole and self.is_streaming(index):
+            return self._stream_doc
+        return None
+
+    def append(self, role, text):
+        n = len(self._texts)
+        self.beginInsertRows(QModelIndex(), n, n)
+        self._roles.append(role)
+        self._texts.append(text)
+        self.endInsertRows()
+
+    def clear(self):
+        self.set_rows([])
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self._roles = [role for role, _ in rows]
+        self._texts = [text for _, text in rows]
+        if self._stream_doc is not None:
+            self._stream_doc.deleteLater()
+        self._stream_doc = None
+        self._stream_row = QPersistentModelIndex()
+        self.endResetModel()
+
+    def begin_stream(self):
+        # Rows such as system notes may be appended after the stream row,
+        # so it is tracked by a persistent index rather than as the last row
+        self.end_stream()
+        doc = QTextDocument(self)
+        self.append("assistant", "")
+        self._stream_doc = doc
+        self._stream_row = QPersistentModelIndex(self.index(len(self._texts) - 1))
+        return doc
+
+    def is_streaming(self, index):
+        return self._stream_doc is not None and self._stream_row.isValid() and index.row() == self._stream_row.row()
+
+    def stream_index(self):
+        return QModelIndex(self._stream_row) if self._stream_doc is not None else QModelIndex()
+
+    def end_stream(self):
+        if self._stream_doc is None:
+            return
+        n = self._stream_row.row()
+        if self._stream_row.isValid():
+            self.beginRemoveRows(QModelIndex(), n, n)
+            del self._roles[n]
+            del self._texts[n]
+            self.endRemoveRows()
+        self._stream_doc.deleteLater()
+        self._stream_doc = None
+        self._stream_row = QPersistentModelIndex()
+
+
+class BubbleDelegate(QStyledItemDelegate):
+    PAD = 10
+    MARGIN = 6
+    CTRL_H = 32  # strip kept free for the hover buttons
+    CTRL_W = 176
+
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self._docs = OrderedDict()  # small LRU of laid-out documents
+        self._sizes = {}  # row -> bubble size at the current width
+        self._width = 0
+        # Rows are only appended, so removals and resets are all that shift them
+        view.model().modelReset.connect(self._sizes.clear)
+        view.model().rowsRemoved.connect(self._sizes.clear)
+        self.anim_row = -1  # row currently sliding in, shifted by anim_offset
+        self.anim_offset = 0
+
+    def _text_width(self):
+        width = int(self.view.viewport().width() * 0.7) - 2 * self.PAD
+        if width != self._width:
+            self._width = width
+            self._sizes.clear()
+        return max(width, 80)
+
+    def _document(self, index):
+        width = self._text_width()
+        doc = index.data(ChatModel.DocRole)
+        if doc is not None:
+            # Re-wrapping relayouts the whole document, so only do it on resize
+            if doc.textWidth() != width:
+                doc.setTextWidth(width)
+            return doc
+        key = (index.data(), width)
+        doc = self._docs.get(key)
+        if doc is None:
+            doc = QTextDocument()
+            doc.setHtml(_format_html(key[0]))
+            doc.setTextWidth(width)
+            self._docs[key] = doc
+            if len(self._docs) > 64:
+                self._docs.popitem(last=False)
+        else:
+            self._docs.move_to_end(key)
+        return doc
+
+    def _bubble_size(self, index):
+        # Stored rows never change, so their size is cached by row number;
+        # this is the hot path of every layout pass over the whole history
+        self._text_width()
+        row = index.row()
+        streaming = index.model().is_streaming(index)
+        if not streaming:
+            size = self._sizes.get(row)
+            if size is not None:
+                return size
+        doc = self._document(index)
+        role = index.data(Qt.ItemDataRole.UserRole)
+        w = int(doc.idealWidth()) + 2 * self.PAD + 1
+        h = int(doc.size().height()) + 2 * self.PAD
+        if role != "system":
+            w = max(w, self.CTRL_W + 2 * self.PAD)
+            h += self.CTRL_H
+        size = QSize(w, h)
+        if not streaming:
+            self._sizes[row] = size
+        return size
+
+    def bubble_rect(self, rect, index):
+        size = self._bubble_size(index)
+        role = index.data(Qt.ItemDataRole.UserRole)
+        if role == "assistant":
+            x = rect.left() + self.MARGIN
+        elif role == "user":
+            x = rect.right() - self.MARGIN - size.width() + 1
+        else:
+            x = rect.left() + (rect.width() - size.width()) // 2
+        if index.row() == self.anim_row:
+            x += self.anim_offset
+        return QRect(x, rect.top() + self.MARGIN, size.width(), size.height())
+
+    def sizeHint(self, option, index):
+        size = self._bubble_size(index)
+        return QSize(self.view.viewport().width(), size.height() + 2 * self.MARGIN)
+
+    def paint(self, painter, option, index):
+        doc = self._document(index)
+        r = self.bubble_rect(option.rect, index)
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(Qt.PenStyle.NoPen)
+        if index.data(Qt.ItemDataRole.UserRole) == "user":
+            painter.setBrush(option.palette.button())
+        else:
+            painter.setBrush(option.palette.alternateBase())
+        painter.drawRoundedRect(r, 8, 8)
+        painter.translate(r.left() + self.PAD, r.top() + self.PAD)
+        doc.drawContents(painter, QRectF(0, 0, r.width() - 2 * self.PAD, doc.size().height()))
+        painter.restore()
+
+
 class AIAssistantApp(QWidget):
 
     def __init__(self):
@@ -138,19 +485,83 @@ class AIAssistantApp(QWidget):
         self.resize(1100, 700)
 
         self.current_model = None
-        self.chat_sessions = []  
+        # Sessions are stored as parallel arrays; session_index maps id -> slot
+        self.session_ids = []
+        self.session_titles = []
+        self.session_msgs = []  # (role, content) tuples, or None until loaded from the db
+        self.session_index = {}
         self.current_session_id = None
+        self._next_sid = 0
 
         self.ollama_worker = None
         self.voice_thread = None
         self.tts_thread = None
+        self.file_thread = None
         self.recognizer = sr.Recognizer()
+        # Owned here rather than by the short-lived VoiceThread
+        self.recognize_pool = QThreadPool(self)
+        self.recognize_pool.setMaxThreadCount(4)
         self.tts_engine = pyttsx3.init()
-
+        self._tts_done = None
+        self._sound_active = False
+        self.sound = None
+        if QSoundEffect is not None:
+            self.sound = QSoundEffect(self)
+            self.sound.playingChanged.connect(self._on_sound_playing)
+            self.sound.statusChanged.connect(self._on_sound_status)
+
+        # The worker's chunk queue is drained into the view at ~30 Hz
+        self._stream_queue = None
+        self._stream_view = None
+        self._stream_height = -1
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setInterval(33)
+        self._flush_timer.timeout.connect(self._flush_chunks)
+
+        self._db = self._open_db()
         self._build_ui()
+        self._load_sessions()
         self.load_models()
         self.start_new_chat(initial=True)
 
+    def _open_db(self):
+        # A read-only or locked chats.db must not stop the app from starting
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            return self._init_db(sqlite3.connect(CHAT_DB_PATH))
+        except (OSError, sqlite3.Error):
+            return self._init_db(sqlite3.connect(":memory:"))
+
+    def _init_db(self, db):
+        db.execute("CREATE TABLE IF NOT EXISTS session(sid TEXT PRIMARY KEY, title TEXT)")
+        db.execute("CREATE TABLE IF NOT EXISTS msg(sid TEXT, idx INT, role TEXT, content TEXT)")
+        db.execute("CREATE INDEX IF NOT EXISTS msg_sid ON msg(sid, idx)")
+        # Chats the user never wrote in are not worth keeping
+        db.execute("DELETE FROM session WHERE sid NOT IN (SELECT sid FROM msg WHERE role='user')")
+        db.execute("DELETE FROM msg WHERE sid NOT IN (SELECT sid FROM session)")
+        db.commit()
+        return db
+
+    def _load_sessions(self):
+        # Only metadata is read up front; messages load when a chat is opened
+        for sid, title in self._db.execute("SELECT sid, title FROM session ORDER BY rowid"):
+            self.session_index[sid] = len(self.session_ids)
+            self.session_ids.append(sid)
+            self.session_titles.append(title)
+            self.session_msgs.append(None)
+            # Continue numbering after the ids already stored
+            if len(sid) in (8, 12):
+                try:
+                    self._next_sid = max(self._next_sid, int(sid[:8], 16) + 1)
+                except ValueError:
+                    pass
+
+    def _load_messages(self, idx):
+        if self.session_msgs[idx] is None:
+            rows = self._db.execute("SELECT role, content FROM msg WHERE sid=? ORDER BY idx", (self.session_ids[idx],))
+            self.session_msgs[idx] = [tuple(r) for r in rows]
+        return self.session_msgs[idx]
+
     def _build_ui(self):
         layout = QHBoxLayout(self)
 
@@ -191,13 +602,30 @@ class AIAssistantApp(QWidget):
         self.status_label = QLabel("🔴 Offline")
         right_col.addWidget(self.status_label)
 
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.chat_container = QWidget()
-        self.chat_layout = QVBoxLayout(self.chat_container)
-        self.chat_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
-        self.scroll_area.setWidget(self.chat_container)
-        right_col.addWidget(self.scroll_area, 10)
+        # Only visible rows are painted; no widgets are created per message
+        self.chat_model = ChatModel(self)
+        self.chat_view = QListView()
+        self.chat_view.setModel(self.chat_model)
+        self.chat_delegate = BubbleDelegate(self.chat_view)
+        self.chat_view.setItemDelegate(self.chat_delegate)
+        self.chat_view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.chat_view.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.chat_view.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        # Hover tracking places the shared row buttons; see eventFilter
+        self.chat_view.viewport().setAttribute(Qt.WidgetAttribute.WA_Hover)
+        self.chat_view.viewport().installEventFilter(self)
+        self.chat_view.verticalScrollBar().valueChanged.connect(self._on_chat_scrolled)
+        self.chat_model.modelReset.connect(self._hide_row_actions)
+        right_col.addWidget(self.chat_view, 10)
+        self._build_row_actions()
+
+        # A single animation is reused for every new bubble
+        self._bubble_anim = QVariantAnimation(self)
+        self._bubble_anim.setDuration(0 if LOW_POWER else 160)
+        self._bubble_anim.setEasingCurve(QEasingCurve.Type.OutQuad)
+        self._bubble_anim.valueChanged.connect(self._on_bubble_anim)
+        self._bubble_anim.finished.connect(self._end_bubble_anim)
+        self.chat_model.modelReset.connect(self._end_bubble_anim)
 
         input_row = QHBoxLayout()
         self.input_box = QTextEdit()
@@ -212,11 +640,103 @@ class AIAssistantApp(QWidget):
 
         layout.addLayout(right_col, 3)
 
+    def _build_row_actions(self):
+        # One set of Copy/Read/Stop buttons, moved onto whichever row is hovered
+        self._row_actions = QFrame(self.chat_view.viewport())
+        al = QHBoxLayout(self._row_actions)
+        al.setContentsMargins(0, 0, 0, 0)
+        al.addStretch(1)
+        self.copy_btn = QPushButton("📋 Copy")
+        self.copy_btn.setFixedWidth(80)
+        self.copy_btn.clicked.connect(lambda: QApplication.clipboard().setText(self._action_text()))
+        al.addWidget(self.copy_btn)
+        self.read_btn = QPushButton("🔊 Read")
+        self.read_btn.setFixedWidth(80)
+        self.read_btn.clicked.connect(self._read_row)
+        al.addWidget(self.read_btn)
+        self.stop_btn = QPushButton("⛔ Stop")
+        self.stop_btn.setFixedWidth(80)
+        self.stop_btn.clicked.connect(self._stop_tts)
+        al.addWidget(self.stop_btn)
+        self._row_actions.hide()
+        self._action_index = QPersistentModelIndex()
+        self._speaking_index = QPersistentModelIndex()
+
+    def eventFilter(self, obj, event):
+        if obj is self.chat_view.viewport():
+            if event.type() == QEvent.Type.HoverMove:
+                self._hover_at(event.position().toPoint())
+            elif event.type() == QEvent.Type.HoverLeave and not self._row_actions.underMouse():
+                self._hide_row_actions()
+        return super().eventFilter(obj, event)
+
+    def _on_chat_scrolled(self):
+        # Rows move under a still cursor, so re-check which one is hovered
+        viewport = self.chat_view.viewport()
+        if viewport.underMouse():
+            self._hover_at(viewport.mapFromGlobal(QCursor.pos()))
+        else:
+            self._hide_row_actions()
+
+    def _hover_at(self, pos):
+        index = self.chat_view.indexAt(pos)
+        if not index.isValid():
+            self._hide_row_actions()
+        elif self._row_actions.isVisible() and QPersistentModelIndex(index) == self._action_index:
+            self._update_row_actions()
+        else:
+            self._show_row_actions(index)
+
+    def _show_row_actions(self, index):
+        if index.data(Qt.ItemDataRole.UserRole) == "system" or self.chat_model.is_streaming(index):
+            self._hide_row_actions()
+            return
+        self._action_index = QPersistentModelIndex(index)
+        self._update_row_actions()
+        self._row_actions.show()
+        self._row_actions.raise_()
+
+    def _update_row_actions(self):
+        index = QModelIndex(self._action_index)
+        if not index.isValid():
+            self._hide_row_actions()
+            return
+        assistant = index.data(Qt.ItemDataRole.UserRole) == "assistant"
+        speaking = self._speaking_index.isValid() and self._speaking_index == self._action_index
+        self.read_btn.setVisible(assistant and not speaking)
+        self.stop_btn.setVisible(assistant and speaking)
+        self._row_actions.adjustSize()
+        d = self.chat_delegate
+        r = d.bubble_rect(self.chat_view.visualRect(index), index)
+        self._row_actions.move(
+            r.right() - d.PAD - self._row_actions.width() + 1,
+            r.bottom() - d.PAD - self._row_actions.height() + 1,
+        )
+
+    def _hide_row_actions(self):
+        self._row_actions.hide()
+        self._action_index = QPersistentModelIndex()
+
+    def _action_text(self):
+        index = QModelIndex(self._action_index)
+        return index.data() if index.isValid() else ""
+
+    def _read_row(self):
+        self._stop_tts()
+        self._speaking_index = QPersistentModelIndex(self._action_index)
+        self._update_row_actions()
+        self._speak(_TAG_RE.sub("", self._action_text()), self._on_row_spoken)
+
+    def _on_row_spoken(self):
+        self._speaking_index = QPersistentModelIndex()
+        if self._row_actions.isVisible():
+            self._update_row_actions()
+
     def load_models(self):
         self.model_dropdown.clear()
         self.status_label.setText("🟡 Fetching models...")
         try:
-            r = requests.get(f"{OLLAMA_API_URL}/api/tags", timeout=5)
+            r = SESSION.get(f"{OLLAMA_API_URL}/api/tags", timeout=5)
             r.raise_for_status()
             data = r.json()
             models = [m.get("name") for m in data.get("models", []) if m.get("name")]
@@ -235,10 +755,16 @@ class AIAssistantApp(QWidget):
         self.current_model = self.model_dropdown.currentText()
 
     def start_new_chat(self, initial=False):
-        cid = str(uuid.uuid4())
-        session = {"id": cid, "title": "New Chat", "messages": []}
-
-        self.chat_sessions.insert(0, session)
+        # The suffix keeps ids apart when two windows share chats.db
+        cid = f"{self._next_sid:08x}{secrets.token_hex(2)}"
+        self._next_sid += 1
+        self.session_index[cid] = len(self.session_ids)
+        self.session_ids.append(cid)
+        self.session_titles.append("New Chat")
+        self.session_msgs.append([])
+        self._db.execute("INSERT OR IGNORE INTO session(sid, title) VALUES (?, ?)", (cid, "New Chat"))
+        self._db.commit()
+        self._unload_current()
         self.current_session_id = cid
         self._refresh_chat_list()
         self._clear_chat_display()
@@ -247,109 +773,87 @@ class AIAssistantApp(QWidget):
 
     def _refresh_chat_list(self):
         self.chat_list.clear()
-        for s in self.chat_sessions:
-            item = QListWidgetItem(s.get("title", "Chat"))
-            item.setData(Qt.ItemDataRole.UserRole, s["id"])
+        # Newest chat first
+        for i in range(len(self.session_ids) - 1, -1, -1):
+            item = QListWidgetItem(self.session_titles[i] or "Chat")
+            item.setData(Qt.ItemDataRole.UserRole, self.session_ids[i])
             self.chat_list.addItem(item)
 
     def _on_chat_selected(self, item):
         cid = item.data(Qt.ItemDataRole.UserRole)
         if cid == self.current_session_id:
             return
+        self._unload_current()
         self.current_session_id = cid
-        self._clear_chat_display()
-        session = self._get_session()
-        for m in session.get("messages", []):
-            self._render_message(m["role"], m["content"], initial=True)
+        # Swap the whole history in with a single model reset
+        self.chat_model.set_rows(self._load_messages(self._get_session()))
+        QTimer.singleShot(60, self._scroll_bottom)
 
     def _get_session(self):
-        return next(s for s in self.chat_sessions if s["id"] == self.current_session_id)
+        return self.session_index[self.current_session_id]
 
-    def _clear_chat_display(self):
-        while self.chat_layout.count():
-            it = self.chat_layout.takeAt(0)
-            if it.widget():
-                it.widget().deleteLater()
-
-    def _render_message(self, role, text, initial=False):
+    def _unload_current(self):
+        # Inactive chats keep only their metadata in memory
+        if self.current_session_id is not None:
+            self.session_msgs[self._get_session()] = None
 
+    def _clear_chat_display(self):
+        self.chat_model.clear()
+
+    def _record_message(self, idx, role, text):
+        sid = self.session_ids[idx]
+        current = sid == self.current_session_id
+        msgs = self._load_messages(idx)
+        first_user = role == "user" and all(r != "user" for r, _ in msgs)
+        # Another instance's startup prune may have removed this session row
+        self._db.execute("INSERT OR IGNORE INTO session(sid, title) VALUES (?, ?)", (sid, self.session_titles[idx]))
+        self._db.execute(
+            "INSERT INTO msg(sid, idx, role, content) VALUES (?, ?, ?, ?)",
+            (sid, len(msgs), role, text),
+        )
+        msgs.append((role, text))
+        if first_user:
+            self.session_titles[idx] = text[:30] + ("..." if len(text) > 30 else "")
+            self._db.execute("UPDATE session SET title=? WHERE sid=?", (self.session_titles[idx], sid))
+            self._refresh_chat_list()
+        self._db.commit()
+        if not current:
+            self.session_msgs[idx] = None
+
+    def _render_message(self, role, text, initial=False, idx=None):
+        # idx targets a chat other than the displayed one, e.g. a reply that
+        # finished after the user switched away
+        if idx is None:
+            idx = self._get_session()
         if not initial:
-            session = self._get_session()
-            session["messages"].append({"role": role, "content": text})
-            if role == "user" and sum(1 for m in session["messages"] if m["role"] == "user") == 1:
-                session["title"] = text[:30] + ("..." if len(text) > 30 else "")
-                self._refresh_chat_list()
-
-        bubble = QFrame()
-        bl = QVBoxLayout(bubble)
-        lbl = QLabel()
-        lbl.setWordWrap(True)
-        lbl.setText(self._format_html(text))
-        bl.addWidget(lbl)
-
-        ctrl = QHBoxLayout()
-        ctrl.addStretch(1)
-        copy_btn = QPushButton("📋 Copy")
-        copy_btn.setFixedWidth(80)
-        copy_btn.clicked.connect(lambda: QApplication.clipboard().setText(text))
-        ctrl.addWidget(copy_btn)
+            self._record_message(idx, role, text)
+        if idx != self._get_session():
+            return
 
-        if role == "assistant":
-            read_btn = QPushButton("🔊 Read")
-            read_btn.setFixedWidth(80)
-            stop_btn = QPushButton("⛔ Stop")
-            stop_btn.setFixedWidth(80)
-            stop_btn.setVisible(False)
-            ctrl.addWidget(read_btn)
-            ctrl.addWidget(stop_btn)
-
-            def start_tts():
-                self._stop_tts()
-                clean = re.sub(r"<[^>]*>", "", text)
-                self.tts_thread = TTSThread(self.tts_engine, clean)
-                read_btn.setVisible(False)
-                stop_btn.setVisible(True)
-                self.tts_thread.finished_speaking.connect(lambda: (stop_btn.setVisible(False), read_btn.setVisible(True), setattr(self, 'tts_thread', None)))
-                self.tts_thread.start()
-
-            def stop_tts():
-                self._stop_tts()
-                stop_btn.setVisible(False)
-                read_btn.setVisible(True)
-
-            read_btn.clicked.connect(start_tts)
-            stop_btn.clicked.connect(stop_tts)
-
-        bl.addLayout(ctrl)
-
-        row = QHBoxLayout()
-        row_widget = QWidget()
-        row_layout = QHBoxLayout(row_widget)
-        if role == "assistant":
-            row_layout.addWidget(bubble)
-            row_layout.addStretch(1)
-        else:
-            row_layout.addStretch(1)
-            row_layout.addWidget(bubble)
+        self.chat_model.append(role, text)
+        if not initial and not LOW_POWER:
+            self._animate_row(self.chat_model.rowCount() - 1, role)
+        QTimer.singleShot(60, self._scroll_bottom)
 
-        self.chat_layout.addWidget(row_widget)
+    def _animate_row(self, row, role):
+        self._bubble_anim.stop()
+        self.chat_delegate.anim_row = row
+        self._bubble_anim.setStartValue(20 if role == "assistant" else -20)
+        self._bubble_anim.setEndValue(0)
+        self._bubble_anim.start()
 
-        anim = QPropertyAnimation(bubble, b"pos")
-        anim.setDuration(160)
-        anim.setStartValue(bubble.pos() + QPoint(20 if role == "assistant" else -20, 0))
-        anim.setEndValue(bubble.pos())
-        anim.setEasingCurve(QEasingCurve.Type.OutQuad)
-        anim.start()
+    def _on_bubble_anim(self, value):
+        self.chat_delegate.anim_offset = value
+        self.chat_view.viewport().update()
 
-        QTimer.singleShot(60, self._scroll_bottom)
-
-    def _format_html(self, t):
-        s = re.sub(r"<", "&lt;", t)
-        s = re.sub(r">", "&gt;", s)
-        return s.replace("\n", "<br>")  
+    def _end_bubble_anim(self):
+        self._bubble_anim.stop()
+        self.chat_delegate.anim_row = -1
+        self.chat_delegate.anim_offset = 0
+        self.chat_view.viewport().update()
 
     def _scroll_bottom(self):
-        self.scroll_area.verticalScrollBar().setValue(self.scroll_area.verticalScrollBar().maximum())
+        self.chat_view.scrollToBottom()
 
     def send_message(self):
         user_text = self.input_box.toPlainText().strip()
@@ -359,21 +863,11 @@ class AIAssistantApp(QWidget):
             self._show_system("Select a model first")
             return
 
-        session = self._get_session()
-        session["messages"].append({"role": "user", "content": user_text})
+        idx = self._get_session()
         self._render_message("user", user_text)
         self.input_box.clear()
 
-        placeholder_lbl = QLabel("")
-        placeholder_lbl.setWordWrap(True)
-        ph_bubble = QFrame()
-        ph_layout = QVBoxLayout(ph_bubble)
-        ph_layout.addWidget(placeholder_lbl)
-        ph_row = QWidget()
-        ph_row_layout = QHBoxLayout(ph_row)
-        ph_row_layout.addWidget(ph_bubble)
-        ph_row_layout.addStretch(1)
-        self.chat_layout.addWidget(ph_row)
+        placeholder = self.chat_model.begin_stream()
         QTimer.singleShot(60, self._scroll_bottom)
 
         if self.ollama_worker:
@@ -384,63 +878,150 @@ class AIAssistantApp(QWidget):
                 pass
             self.ollama_worker = None
 
-        messages = session["messages"]
-        self.ollama_worker = OllamaWorker(self.current_model, messages)
+        messages = [{"role": r, "content": c} for r, c in self.session_msgs[idx][-MAX_CTX_MSGS:]]
+        worker = OllamaWorker(self.current_model, messages)
+        self.ollama_worker = worker
 
-        def on_chunk(chunk):
-            current = re.sub(r"<[^>]*>", "", placeholder_lbl.text())
-            new_text = current + chunk
-            placeholder_lbl.setText(self._format_html(new_text))
-            self._scroll_bottom()
+        self._stream_queue = worker.chunks
+        self._stream_view = placeholder
+        self._stream_height = -1
+        self._flush_timer.start()
 
-        self.ollama_worker.response_chunk.connect(on_chunk)
-        self.ollama_worker.error_occurred.connect(lambda e: self._show_system(f"AI Error: {e}"))
+        # A stopped worker still emits; ignore it once a newer one has taken over
+        def on_error(e):
+            if self.ollama_worker is not worker:
+                return
+            self._end_streaming()
+            self._show_system(f"AI Error: {e}")
 
-        def on_full(full_text):
-            try:
-                last_idx = self.chat_layout.count() - 1
-                if last_idx >= 0:
-                    it = self.chat_layout.takeAt(last_idx)
-                    if it and it.widget():
-                        it.widget().deleteLater()
-            except Exception:
-                pass
+        worker.error_occurred.connect(on_error)
 
-            session["messages"].append({"role": "assistant", "content": full_text})
-            self._render_message("assistant", full_text)
+        def on_full(full_text):
+            if self.ollama_worker is not worker:
+                return
+            self._end_streaming()
+            self._render_message("assistant", full_text, idx=idx)
             self.ollama_worker = None
 
-        self.ollama_worker.full_response.connect(on_full)
-        self.ollama_worker.typing_signal.connect(lambda b: self.status_label.setText("🟡 AI typing..." if b else "🟢 Online"))
-        self.ollama_worker.start()
+        def on_typing(b):
+            if self.ollama_worker is worker or (not b and self.ollama_worker is None):
+                self.status_label.setText("🟡 AI typing..." if b else "🟢 Online")
+
+        worker.full_response.connect(on_full)
+        worker.typing_signal.connect(on_typing)
+        worker.start()
+
+    def _end_streaming(self):
+        self._flush_timer.stop()
+        self._stream_queue = None
+        self._stream_view = None
+        self.chat_model.end_stream()
+
+    def _flush_chunks(self):
+        if self._stream_queue is None or self._stream_view is None:
+            return
+        parts = []
+        while True:
+            try:
+                parts.append(self._stream_queue.get_nowait())
+            except queue.Empty:
+                break
+        index = self.chat_model.stream_index()
+        if not parts or not index.isValid():
+            # A chat switch drops the stream row; its chunks have nowhere to go
+            return
+        # Append only the new text; insertText escapes it for us
+        text = "".join(parts)
+        bar = self.chat_view.verticalScrollBar()
+        at_bottom = bar.value() >= bar.maximum()
+        cursor = QTextCursor(self._stream_view)
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.insertText(text)
+        # Relayouting means a pass over every row, so only ask for one when
+        # the text wrapped onto a new line; otherwise repainting the row is enough
+        height = self._stream_view.size().height()
+        if height != self._stream_height:
+            self._stream_height = height
+            self.chat_delegate.sizeHintChanged.emit(index)
+        else:
+            self.chat_view.viewport().update(self.chat_view.visualRect(index))
+        if at_bottom:
+            self._scroll_bottom()
 
     def _show_system(self, text):
-        bubble = QFrame()
-        bl = QVBoxLayout(bubble)
-        lbl = QLabel(text)
-        lbl.setWordWrap(True)
-        bl.addWidget(lbl)
-        row_widget = QWidget()
-        row_layout = QHBoxLayout(row_widget)
-        row_layout.addStretch(1)
-        row_layout.addWidget(bubble)
-        row_layout.addStretch(1)
-        self.chat_layout.addWidget(row_widget)
+        self.chat_model.append("system", text)
         QTimer.singleShot(60, self._scroll_bottom)
 
+    def _speak(self, text, on_done):
+        self._tts_done = on_done
+        path = None
+        if self.sound is not None:
+            # Synthesize each message once, then replay the cached WAV
+            key = hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+            path = os.path.join(TTS_CACHE_DIR, f"{key}.wav")
+            if os.path.exists(path):
+                self._play_wav(path)
+                return
+            try:
+                os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+            except OSError:
+                path = None  # cache not writable; speak without caching
+        t = TTSThread(self.tts_engine, text, path)
+        t.finished_speaking.connect(lambda: self._on_tts_saved(t, path))
+        self.tts_thread = t
+        t.start()
+
+    def _on_tts_saved(self, thread, path):
+        # Ignore synthesis runs that were stopped or superseded
+        if self.tts_thread is not thread:
+            return
+        self.tts_thread = None
+        if path is None:
+            self._finish_tts()
+        else:
+            self._play_wav(path)
+
+    def _play_wav(self, path):
+        if not os.path.exists(path):
+            self._finish_tts()
+            return
+        self._sound_active = True
+        self.sound.setSource(QUrl.fromLocalFile(path))
+        self.sound.play()
+
+    def _on_sound_playing(self):
+        if self._sound_active and not self.sound.isPlaying():
+            self._sound_active = False
+            self._finish_tts()
+
+    def _on_sound_status(self):
+        # A file QSoundEffect cannot load never starts playing, so end here
+        if self._sound_active and self.sound.status() == QSoundEffect.Status.Error:
+            self._sound_active = False
+            self._finish_tts()
+
+    def _finish_tts(self):
+        done, self._tts_done = self._tts_done, None
+        if done:
+            done()
+
     def _stop_tts(self):
+        if self.sound is not None:
+            self._sound_active = False
+            self.sound.stop()
         try:
             if self.tts_thread and self.tts_thread.isRunning():
                 self.tts_thread.stop()
                 self.tts_thread.wait(200)
-                self.tts_thread = None
+            self.tts_thread = None
         except Exception:
             pass
+        self._finish_tts()
 
     def start_voice(self):
         if self.voice_thread and self.voice_thread.isRunning():
             return
-        self.voice_thread = VoiceThread(self.recognizer)
+        self.voice_thread = VoiceThread(self.recognizer, self.recognize_pool)
         self.voice_thread.text_recognized.connect(lambda t: self.input_box.insertPlainText((" " + t) if self.input_box.toPlainText() else t))
         self.voice_thread.listening_status.connect(lambda s: self.status_label.setText("🎤 Listening..." if s else "🟢 Online"))
         self.voice_thread.start()
@@ -457,33 +1038,25 @@ class AIAssistantApp(QWidget):
         if dlg.exec() == QFileDialog.DialogCode.Accepted:
             f = dlg.selectedFiles()[0]
             ext = os.path.splitext(f)[1].lower()
-            content = ""
-            try:
-                if ext == ".txt":
-                    with open(f, "r", encoding="utf-8") as fh:
-                        content = fh.read()
-                elif ext == ".docx":
-                    if docx is None:
-                        self._show_system("python-docx not installed")
-                        return
-                    d = docx.Document(f)
-                    content = "\n".join 
-                elif ext == ".pdf":
-                    if PdfReader is None:
-                        self._show_system("PyPDF2 not installed")
-                        return
-                    reader = PdfReader(f)
-                    for p in reader.pages:
-                        try:
-                            content += (p.extract_text() or "") + "\n" 
-                        except Exception:
-                            continue
-                else:
-                    self._show_system(f"Unsupported: {ext}")
-                    return
-                self.input_box.insertPlainText(content)
-            except Exception as e:
-                self._show_system(f"File read error: {e}")
+            if ext == ".docx" and docx is None:
+                self._show_system("python-docx not installed")
+                return
+            if ext == ".pdf" and PdfReader is None:
+                self._show_system("PyPDF2 not installed")
+                return
+            if ext not in (".txt", ".docx", ".pdf"):
+                self._show_system(f"Unsupported: {ext}")
+                return
+            if self.file_thread and self.file_thread.isRunning():
+                return
+
+            # Parse off the GUI thread and insert everything in one go
+            parts = []
+            self.file_thread = FileParseThread(f, ext)
+            self.file_thread.page_ready.connect(parts.append)
+            self.file_thread.error_occurred.connect(lambda e: self._show_system(f"File read error: {e}"))
+            self.file_thread.finished_parsing.connect(lambda: (self.input_box.insertPlainText("".join(parts)), setattr(self, 'file_thread', None)))
+            self.file_thread.start()
 
 
 if __name__ == "__main__":